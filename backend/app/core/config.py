@@ -12,7 +12,27 @@ class Settings(BaseSettings):
     MQTT_BROKER: str = "localhost"  # Local Mosquitto broker
     MQTT_PORT: int = 1883
     MQTT_TOPIC: str = "device/+/data"
-    MQTT_CLIENT_ID: str = "mapapp_service"
+    MQTT_CLIENT_ID: str = "mapapp_service"  # Prefix; the instance ID is appended
+    MQTT_INSTANCE_ID: Optional[str] = None  # Required unless MQTT_CLEAN_SESSION; stable and unique per instance
+    # Delivery QoS is the lower of the publish and subscribe QoS. The firmware's
+    # PubSubClient only publishes at QoS 0, so the broker does not queue device
+    # data for an offline persistent session unless it is configured to
+    # (Mosquitto: queue_qos0_messages true) or the devices publish at QoS 1.
+    MQTT_QOS: int = 1
+    MQTT_CLEAN_SESSION: bool = False
+    MQTT_KEEPALIVE: int = 60
+    MQTT_RECONNECT_MIN_DELAY: float = 0.5  # seconds
+    MQTT_RECONNECT_MAX_DELAY: float = 30.0  # seconds
+    MQTT_DRAIN_TIMEOUT: float = 10.0  # seconds
+    MQTT_MAX_REDELIVERIES: int = 10  # attempts per message while the database is unavailable
+
+    # Analytics Settings
+    ANALYTICS_FETCH_SIZE: int = 10000  # rows per server-side cursor fetch
+    ANALYTICS_CACHE_MAX_FEATURES: int = 200000  # total GeoJSON features held across cached responses
+    ANALYTICS_CACHE_TTL: int = 300  # seconds
+    ANALYTICS_MAX_POINTS: int = 2000000
+    ANALYTICS_MAX_CELLS: int = 20000
+    ANALYTICS_MAX_CLUSTER_POINTS: int = 5000
 
     class Config:
         env_file = ".env"
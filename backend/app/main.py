@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .routes import location, device, device_log
+from sqlalchemy import text
+from .routes import location, device, device_log, analytics
 from .core.database import engine
 from .models import location as location_model, device as device_model, device_log as device_log_model
 
@@ -9,6 +10,14 @@ location_model.Base.metadata.create_all(bind=engine)
 device_model.Base.metadata.create_all(bind=engine)
 device_log_model.Base.metadata.create_all(bind=engine)
 
+# create_all skips tables that already exist, so indexes added to existing
+# tables are created here. CONCURRENTLY keeps MQTT ingest writing meanwhile.
+with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+    connection.execute(text(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_device_logs_deviceid_time_log "
+        "ON device_logs (deviceid, time_log)"
+    ))
+
 app = FastAPI(title="MapApp API")
 
 # CORS middleware configuration
@@ -24,6 +33,7 @@ app.add_middleware(
 app.include_router(location.router)
 app.include_router(device.router)
 app.include_router(device_log.router)
+app.include_router(analytics.router)
 
 @app.get("/")
 async def root():
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, JSON, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, JSON, ForeignKey, DateTime, Index
 import datetime
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
@@ -7,6 +7,10 @@ from .device import Device  # Import the Device model
 
 class DeviceLog(Base):
     __tablename__ = "device_logs"
+    __table_args__ = (
+        # Serves per-device time range scans, including multi-device track queries
+        Index("ix_device_logs_deviceid_time_log", "deviceid", "time_log"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     deviceid = Column(UUID(as_uuid=True), ForeignKey("devices.deviceid"))
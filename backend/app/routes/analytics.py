@@ -0,0 +1,78 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from uuid import UUID
+from datetime import datetime
+from ..core.database import get_db
+from ..services import analytics
+
+router = APIRouter(
+    prefix="/analytics",
+    tags=["analytics"]
+)
+
+def _validate_range(start_date: datetime, end_date: datetime):
+    if end_date <= start_date:
+        raise HTTPException(status_code=422, detail="end_date must be after start_date")
+
+@router.get("/heatmap")
+def get_heatmap(
+    start_date: datetime,
+    end_date: datetime,
+    device_ids: Optional[List[UUID]] = Query(None),
+    precision: int = Query(7, ge=1, le=9),
+    db: Session = Depends(get_db)
+):
+    """Point density per geohash cell as a GeoJSON FeatureCollection of polygons"""
+    _validate_range(start_date, end_date)
+    device_ids = sorted(set(device_ids or []))
+    key = analytics.cache.fingerprint(
+        "heatmap",
+        device_ids=device_ids,
+        start_date=start_date,
+        end_date=end_date,
+        precision=precision
+    )
+    try:
+        return analytics.cache.get_or_compute(
+            key,
+            lambda: analytics.heatmap_geojson(db, device_ids, start_date, end_date, precision)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.get("/dwell-clusters")
+def get_dwell_clusters(
+    start_date: datetime,
+    end_date: datetime,
+    device_ids: Optional[List[UUID]] = Query(None),
+    stop_radius: float = Query(30, gt=0),  # meters a stop may drift from where it began
+    min_dwell: float = Query(300, ge=0),  # seconds
+    stop_speed: float = Query(5, ge=0),  # km/h at or below which a sample is stationary
+    eps: float = Query(50, gt=0),  # meters
+    min_samples: int = Query(3, ge=1),
+    db: Session = Depends(get_db)
+):
+    """Clusters of stops across devices as a GeoJSON FeatureCollection of points"""
+    _validate_range(start_date, end_date)
+    device_ids = sorted(set(device_ids or []))
+    key = analytics.cache.fingerprint(
+        "dwell-clusters",
+        device_ids=device_ids,
+        start_date=start_date,
+        end_date=end_date,
+        stop_radius=stop_radius,
+        min_dwell=min_dwell,
+        stop_speed=stop_speed,
+        eps=eps,
+        min_samples=min_samples
+    )
+    try:
+        return analytics.cache.get_or_compute(
+            key,
+            lambda: analytics.dwell_clusters_geojson(
+                db, device_ids, start_date, end_date, stop_radius, min_dwell, stop_speed, eps, min_samples
+            )
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
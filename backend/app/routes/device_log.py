@@ -1,5 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import cast, func, true
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
+from sqlalchemy.orm import Session, aliased
+import numpy as np
 from typing import List
 from uuid import UUID
 from ..core.database import get_db
@@ -53,6 +56,94 @@ def get_device_logs_by_device(
             .all()
     return logs
 
+def _track_coordinates(log):
+    try:
+        lat = float(log.data["latitude"])
+        lon = float(log.data["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if -90 <= lat <= 90 and -180 <= lon <= 180:
+        return (lon, lat)
+    return None
+
+def _douglas_peucker(points, tolerance):
+    """Boolean mask of the vertices Douglas-Peucker keeps; endpoints are always kept"""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, direction = points[first], points[last] - points[first]
+        inner = points[first + 1:last] - start
+        length2 = direction @ direction
+        t = np.clip(inner @ direction / length2, 0, 1) if length2 else np.zeros(len(inner))
+        distances = np.hypot(*(inner - t[:, None] * direction).T)
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.extend([(first, split), (split, last)])
+    return keep
+
+def _simplify_track(logs, tolerance):
+    """Simplify a track, keeping the original log entries at the surviving vertices.
+
+    Logs without valid coordinates are not part of the geometry and are passed
+    through unchanged, so simplification only ever drops located points.
+    """
+    coords = [_track_coordinates(log) for log in logs]
+    located = [i for i, c in enumerate(coords) if c is not None]
+    if len(located) < 3:
+        return logs
+
+    keep = np.ones(len(logs), dtype=bool)
+    keep[located] = _douglas_peucker(np.array([coords[i] for i in located]), tolerance)
+    return [log for log, kept in zip(logs, keep) if kept]
+
+@router.post("/device-log/tracks", response_model=List[device_log_schema.DeviceTrack])
+def get_device_tracks(request: device_log_schema.BulkTrackRequest, db: Session = Depends(get_db)):
+    """Fetch tracks for several devices in one query, grouped by device"""
+    # unnest() the requested IDs and read each device's first rows through a
+    # LATERAL subquery, so every device is an index range scan that stops after
+    # limit_per_device + 1 rows. The extra row tells us the track was truncated.
+    requested = func.unnest(cast(request.device_ids, ARRAY(PG_UUID(as_uuid=True))))\
+            .table_valued("deviceid")\
+            .render_derived(name="requested")
+
+    query = db.query(device_log_model.DeviceLog)\
+            .filter(device_log_model.DeviceLog.deviceid == requested.c.deviceid)
+
+    if request.start_date:
+        query = query.filter(device_log_model.DeviceLog.time_log >= request.start_date)
+    if request.end_date:
+        query = query.filter(device_log_model.DeviceLog.time_log <= request.end_date)
+
+    track = query.order_by(device_log_model.DeviceLog.time_log.asc())\
+            .limit(request.limit_per_device + 1)\
+            .subquery()\
+            .lateral("track")
+    track_log = aliased(device_log_model.DeviceLog, track)
+    logs = db.query(track_log)\
+            .select_from(requested)\
+            .join(track, true())\
+            .order_by(track_log.deviceid, track_log.time_log.asc())\
+            .all()
+
+    tracks = {device_id: [] for device_id in request.device_ids}
+    for log in logs:
+        tracks[log.deviceid].append(log)
+
+    response = []
+    for device_id, track_logs in tracks.items():
+        truncated = len(track_logs) > request.limit_per_device
+        track_logs = track_logs[:request.limit_per_device]
+        if request.tolerance:
+            track_logs = _simplify_track(track_logs, request.tolerance)
+        response.append({"deviceid": device_id, "logs": track_logs, "truncated": truncated})
+    return response
+
 @router.put("/device-log/{log_id}", response_model=device_log_schema.DeviceLog)
 def update_device_log(log_id: int, device_log: device_log_schema.DeviceLogCreate, db: Session = Depends(get_db)):
     db_log = db.query(device_log_model.DeviceLog).filter(device_log_model.DeviceLog.id == log_id).first()
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, UUID4
-from typing import Dict, Optional
+from pydantic import BaseModel, UUID4, field_validator, model_validator
+from typing import Dict, List, Optional
 from datetime import datetime
 
 class DeviceLogBase(BaseModel):
@@ -15,3 +15,46 @@ class DeviceLog(DeviceLogBase):
 
     class Config:
         from_attributes = True
+
+MAX_TRACK_ROWS = 100000
+
+class BulkTrackRequest(BaseModel):
+    device_ids: List[UUID4]
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    limit_per_device: int = 1000
+    tolerance: Optional[float] = None  # simplification tolerance in degrees
+
+    @field_validator('device_ids')
+    def validate_device_ids(cls, value):
+        if not value:
+            raise ValueError("At least one device ID is required")
+        if len(value) > 500:
+            raise ValueError("No more than 500 devices per request")
+        return list(dict.fromkeys(value))
+
+    @field_validator('limit_per_device')
+    def validate_limit_per_device(cls, value):
+        if value <= 0 or value > 10000:
+            raise ValueError("limit_per_device must be between 1 and 10000")
+        return value
+
+    @field_validator('tolerance')
+    def validate_tolerance(cls, value):
+        if value is not None and value <= 0:
+            raise ValueError("Tolerance must be greater than 0")
+        return value
+
+    @model_validator(mode='after')
+    def validate_total_rows(self):
+        if len(self.device_ids) * self.limit_per_device > MAX_TRACK_ROWS:
+            raise ValueError(
+                f"device_ids x limit_per_device must not exceed {MAX_TRACK_ROWS} rows; "
+                "lower limit_per_device or request fewer devices"
+            )
+        return self
+
+class DeviceTrack(BaseModel):
+    deviceid: UUID4
+    logs: List[DeviceLog]
+    truncated: bool = False  # more logs exist in the range than limit_per_device
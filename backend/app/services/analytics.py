@@ -0,0 +1,355 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, List, Optional
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models.device_log import DeviceLog
+
+EARTH_RADIUS_M = 6371008.8
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+SPEED_WINDOW_S = 30.0
+
+
+class QueryCache:
+    """Thread-safe LRU cache of GeoJSON responses with a TTL, keyed by query fingerprint.
+
+    The cache is bounded by the total number of features it holds rather than
+    by entry count, since one response can be orders of magnitude larger than
+    another. Responses larger than the whole budget are not cached.
+    """
+
+    def __init__(self, max_features: int, ttl: float):
+        self.max_features = max_features
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(kind: str, **params) -> str:
+        payload = json.dumps({"kind": kind, **params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get_or_compute(self, key: str, compute: Callable[[], dict]) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[2]
+
+        value = compute()
+        weight = max(1, len(value.get("features", ())))
+        if weight > self.max_features:
+            return value
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._entries[key] = (now + self.ttl, weight, value)
+            self.size += weight
+            while self.size > self.max_features:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self.size -= evicted
+        return value
+
+
+cache = QueryCache(settings.ANALYTICS_CACHE_MAX_FEATURES, settings.ANALYTICS_CACHE_TTL)
+
+
+def load_positions(
+    db: Session,
+    device_ids: Optional[List[UUID]],
+    start_date: datetime,
+    end_date: datetime,
+):
+    """Stream positions through a server-side cursor into NumPy arrays.
+
+    Returns (devices, device_codes, timestamps, lat, lon, speed) where
+    device_codes index into devices, speed is the device-reported km/h (NaN
+    when missing) and rows are ordered by device, then time. Raises
+    ValueError once more than ANALYTICS_MAX_POINTS rows have been read.
+    """
+    # Only rows with JSON numbers are cast, so free-form payloads such as
+    # "N/A" are skipped instead of failing the whole query
+    query = select(
+        DeviceLog.deviceid,
+        func.extract("epoch", DeviceLog.time_log),
+        DeviceLog.data["latitude"].as_float(),
+        DeviceLog.data["longitude"].as_float(),
+        case((func.json_typeof(DeviceLog.data["speed"]) == "number", DeviceLog.data["speed"].as_float())),
+    ).where(
+        func.json_typeof(DeviceLog.data["latitude"]) == "number",
+        func.json_typeof(DeviceLog.data["longitude"]) == "number",
+        DeviceLog.time_log >= start_date,
+        DeviceLog.time_log <= end_date,
+    )
+
+    if device_ids:
+        query = query.where(DeviceLog.deviceid.in_(device_ids))
+
+    query = query.order_by(DeviceLog.deviceid, DeviceLog.time_log)
+    result = db.execute(query.execution_options(yield_per=settings.ANALYTICS_FETCH_SIZE))
+
+    codes = {}
+    chunks = []
+    total = 0
+    for partition in result.partitions():
+        total += len(partition)
+        if total > settings.ANALYTICS_MAX_POINTS:
+            result.close()
+            raise ValueError(
+                f"Query exceeds the limit of {settings.ANALYTICS_MAX_POINTS} positions; "
+                "narrow the device set or time range"
+            )
+        chunks.append(np.array(
+            [(codes.setdefault(row[0], len(codes)), row[1], row[2], row[3], row[4]) for row in partition],
+            dtype=np.float64,
+        ))
+
+    rows = np.concatenate(chunks) if chunks else np.empty((0, 5))
+    valid = (np.abs(rows[:, 2]) <= 90) & (np.abs(rows[:, 3]) <= 180)
+    rows = rows[valid]
+    return list(codes), rows[:, 0].astype(np.int64), rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 4]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between arrays of points"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def geohash_cell_size(precision: int):
+    """Width and height in degrees of a geohash cell at the given precision"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 360.0 / (1 << lon_bits), 180.0 / (1 << lat_bits)
+
+
+def geohash_encode(ix: int, iy: int, precision: int) -> str:
+    """Encode integer grid indexes (as produced by grid_density) as a geohash"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    bits = 0
+    for k in range(5 * precision):
+        if k % 2 == 0:
+            lon_bits -= 1
+            bits = (bits << 1) | ((ix >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            bits = (bits << 1) | ((iy >> lat_bits) & 1)
+    return "".join(
+        GEOHASH_BASE32[(bits >> shift) & 31] for shift in range(5 * (precision - 1), -1, -5)
+    )
+
+
+def grid_density(lat, lon, precision: int):
+    """Count points per geohash cell; returns (ix, iy, counts) for occupied cells"""
+    cell_w, cell_h = geohash_cell_size(precision)
+    max_ix = (1 << ((5 * precision + 1) // 2)) - 1
+    max_iy = (1 << (5 * precision // 2)) - 1
+    ix = np.clip(np.floor((lon + 180.0) / cell_w).astype(np.int64), 0, max_ix)
+    iy = np.clip(np.floor((lat + 90.0) / cell_h).astype(np.int64), 0, max_iy)
+
+    keys, counts = np.unique(ix * (max_iy + 1) + iy, return_counts=True)
+    return keys // (max_iy + 1), keys % (max_iy + 1), counts
+
+
+def detect_stops(
+    device_codes,
+    timestamps,
+    lat,
+    lon,
+    speed,
+    stop_radius: float,
+    min_dwell: float,
+    stop_speed: float,
+):
+    """Collapse runs of stationary samples into stop events.
+
+    A sample is stationary when its speed is at most stop_speed km/h, using
+    the device-reported speed or, where that is NaN, the average speed over
+    SPEED_WINDOW_S seconds (at least the adjacent samples) around the sample. Consecutive stationary samples of a device form a run,
+    and a run is split whenever a sample lies more than stop_radius meters
+    from the run's first sample, so slow creep is not mistaken for a stop.
+    Runs lasting at least min_dwell seconds are returned as
+    (device_codes, lat, lon, start, end) arrays.
+    """
+    empty = np.empty(0)
+    no_stops = (empty.astype(np.int64), empty, empty, empty, empty)
+    n = len(timestamps)
+    if n == 0:
+        return no_stops
+
+    # Fallback speed is measured across a window centred on each sample, which
+    # averages out GPS jitter that would dominate a single 2 s step. Keys are
+    # offset per device so the window never crosses a device boundary.
+    key = device_codes * 1e12 + timestamps
+    back = np.searchsorted(key, key - SPEED_WINDOW_S / 2, side="left")
+    ahead = np.searchsorted(key, key + SPEED_WINDOW_S / 2, side="right") - 1
+    # Sparse samples leave the window empty; always reach the adjacent samples
+    same_device = device_codes[1:] == device_codes[:-1]
+    position = np.arange(n)
+    back[1:] = np.where(same_device, np.minimum(back[1:], position[:-1]), back[1:])
+    ahead[:-1] = np.where(same_device, np.maximum(ahead[:-1], position[1:]), ahead[:-1])
+    elapsed = timestamps[ahead] - timestamps[back]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        derived = np.where(
+            elapsed > 0,
+            haversine(lat[back], lon[back], lat[ahead], lon[ahead]) / elapsed * 3.6,
+            np.inf,
+        )
+    stationary = np.where(np.isnan(speed), derived, speed) <= stop_speed
+
+    # Work on the stationary samples only; a run breaks at any moving sample
+    # in between or at a device boundary
+    index = np.flatnonzero(stationary)
+    if not index.size:
+        return no_stops
+    codes, times, run_lat, run_lon = device_codes[index], timestamps[index], lat[index], lon[index]
+    run_start = np.ones(len(index), dtype=bool)
+    run_start[1:] = (np.diff(index) != 1) | (codes[1:] != codes[:-1])
+
+    # Split runs at the first sample beyond stop_radius from the run's anchor,
+    # then re-check the remainder from its new anchor until every run fits
+    while True:
+        anchor = np.flatnonzero(run_start)[np.cumsum(run_start) - 1]
+        beyond = np.flatnonzero(
+            haversine(run_lat[anchor], run_lon[anchor], run_lat, run_lon) > stop_radius
+        )
+        if not beyond.size:
+            break
+        _, first = np.unique(anchor[beyond], return_index=True)
+        run_start[beyond[first]] = True
+
+    starts = np.flatnonzero(run_start)
+    ends = np.append(starts[1:], len(index)) - 1
+    keep = times[ends] - times[starts] >= min_dwell
+    if not keep.any():
+        return no_stops
+
+    sizes = (ends - starts + 1)[keep]
+    centre_lat = np.add.reduceat(run_lat, starts)[keep] / sizes
+    centre_lon = np.add.reduceat(run_lon, starts)[keep] / sizes
+    starts, ends = starts[keep], ends[keep]
+    return codes[starts], centre_lat, centre_lon, times[starts], times[ends]
+
+
+def dbscan(lat, lon, eps: float, min_samples: int):
+    """DBSCAN over points using an equirectangular projection; noise is labelled -1"""
+    n = len(lat)
+    if n > settings.ANALYTICS_MAX_CLUSTER_POINTS:
+        raise ValueError(
+            f"{n} stops exceed the clustering limit of {settings.ANALYTICS_MAX_CLUSTER_POINTS}; "
+            "narrow the device set or time range"
+        )
+
+    lat0 = np.radians(lat.mean()) if n else 0.0
+    x = np.radians(lon) * np.cos(lat0) * EARTH_RADIUS_M
+    y = np.radians(lat) * EARTH_RADIUS_M
+
+    # Neighbour lists are built a block of rows at a time, so memory scales
+    # with the number of neighbour pairs rather than n * n
+    neighbours = []
+    chunk = 1024
+    for i in range(0, n, chunk):
+        dx = x[i:i + chunk, None] - x[None, :]
+        dy = y[i:i + chunk, None] - y[None, :]
+        within = dx * dx + dy * dy <= eps * eps
+        rows, cols = np.nonzero(within)
+        neighbours.extend(np.split(cols, np.flatnonzero(np.diff(rows)) + 1) if rows.size else [])
+    core = np.array([len(points) >= min_samples for points in neighbours], dtype=bool)
+
+    labels = np.full(n, -1, dtype=np.int64)
+    cluster = 0
+    for seed in np.flatnonzero(core):
+        if labels[seed] != -1:
+            continue
+        labels[seed] = cluster
+        frontier = np.array([seed])
+        while frontier.size:
+            reached = np.unique(np.concatenate([neighbours[point] for point in frontier]))
+            reached = reached[labels[reached] == -1]
+            labels[reached] = cluster
+            frontier = reached[core[reached]]
+        cluster += 1
+    return labels
+
+
+def heatmap_geojson(db: Session, device_ids, start_date, end_date, precision: int) -> dict:
+    _, _, _, lat, lon, _ = load_positions(db, device_ids, start_date, end_date)
+    ix, iy, counts = grid_density(lat, lon, precision)
+    if len(counts) > settings.ANALYTICS_MAX_CELLS:
+        raise ValueError(
+            f"{len(counts)} cells exceed the heatmap limit of {settings.ANALYTICS_MAX_CELLS}; "
+            "lower the precision or narrow the query"
+        )
+    cell_w, cell_h = geohash_cell_size(precision)
+    peak = counts.max() if counts.size else 1
+
+    features = []
+    for cx, cy, count in zip(ix.tolist(), iy.tolist(), counts.tolist()):
+        west, south = cx * cell_w - 180.0, cy * cell_h - 90.0
+        east, north = west + cell_w, south + cell_h
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[[west, south], [east, south], [east, north], [west, north], [west, south]]],
+            },
+            "properties": {
+                "geohash": geohash_encode(cx, cy, precision),
+                "count": count,
+                "density": count / peak,
+            },
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def dwell_clusters_geojson(
+    db: Session,
+    device_ids,
+    start_date,
+    end_date,
+    stop_radius: float,
+    min_dwell: float,
+    stop_speed: float,
+    eps: float,
+    min_samples: int,
+) -> dict:
+    devices, device_codes, timestamps, lat, lon, speed = load_positions(db, device_ids, start_date, end_date)
+    stop_devices, stop_lat, stop_lon, stop_start, stop_end = detect_stops(
+        device_codes, timestamps, lat, lon, speed, stop_radius, min_dwell, stop_speed
+    )
+    labels = dbscan(stop_lat, stop_lon, eps, min_samples)
+
+    features = []
+    for label in range(labels.max() + 1 if labels.size else 0):
+        members = labels == label
+        dwell = stop_end[members] - stop_start[members]
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [float(stop_lon[members].mean()), float(stop_lat[members].mean())],
+            },
+            "properties": {
+                "cluster": label,
+                "stops": int(members.sum()),
+                "total_dwell_seconds": float(dwell.sum()),
+                "mean_dwell_seconds": float(dwell.mean()),
+                "devices": sorted(str(devices[code]) for code in np.unique(stop_devices[members])),
+            },
+        })
+    return {"type": "FeatureCollection", "features": features}
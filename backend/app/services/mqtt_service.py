@@ -1,7 +1,11 @@
+import hashlib
 import json
 import paho.mqtt.client as mqtt
+from sqlalchemy.exc import InterfaceError, OperationalError
 import uuid
 import logging
+import random
+import signal
 import threading
 import time
 from ..core.config import settings
@@ -15,30 +19,48 @@ logger = logging.getLogger(__name__)
 
 class MQTTService:
     def __init__(self):
-        # Generate a unique client ID
-        self.client_id = f"{settings.MQTT_CLIENT_ID}_{uuid.uuid4().hex[:8]}"
-        logger.info(f"Initializing MQTT client with ID: {settings}")
+        # The client ID must be stable across restarts so the broker can resume
+        # the persistent session, and unique per instance since the broker drops
+        # the older connection whenever another client connects with the same ID
+        self.client_id = self.build_client_id()
+        logger.info(f"Initializing MQTT client with ID: {self.client_id}")
         
-        # Create client with clean session
-        self.client = mqtt.Client(client_id=self.client_id, clean_session=True)
+        self.client = mqtt.Client(client_id=self.client_id, clean_session=settings.MQTT_CLEAN_SESSION)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
         self.client.on_log = self.on_log
         
         # State management
-        self.connected = False
-        self.running = False
-        self.reconnect_interval = 5
+        self.connected_at = None
+        self.reconnect_attempt = 0
+        self.failed_deliveries = {}
+        self._stop_event = threading.Event()
+        self._network_thread = None
+
+    @staticmethod
+    def build_client_id():
+        if settings.MQTT_CLEAN_SESSION and not settings.MQTT_INSTANCE_ID:
+            # Nothing to resume, so a throwaway ID is fine
+            return f"{settings.MQTT_CLIENT_ID}_{uuid.uuid4().hex[:8]}"
+
+        # The hostname is no substitute: under Docker it is the container ID,
+        # which changes whenever the container is recreated and would orphan
+        # the previous session along with its queued messages
+        if not settings.MQTT_INSTANCE_ID:
+            raise ValueError(
+                "Persistent MQTT sessions need a stable, unique client ID; set MQTT_INSTANCE_ID "
+                "or MQTT_CLEAN_SESSION=true"
+            )
+        return f"{settings.MQTT_CLIENT_ID}_{settings.MQTT_INSTANCE_ID}"
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            self.connected = True
-            logger.info("Successfully connected to MQTT broker")
+            self.connected_at = time.monotonic()
+            logger.info(f"Successfully connected to MQTT broker (session present: {flags.get('session present')})")
             logger.info(f"Subscribing to topic: {settings.MQTT_TOPIC}")
-            client.subscribe(settings.MQTT_TOPIC)
+            client.subscribe(settings.MQTT_TOPIC, qos=settings.MQTT_QOS)
         else:
-            self.connected = False
             logger.error(f"Failed to connect to MQTT broker with code {rc}")
             connection_codes = {
                 1: "Incorrect protocol version",
@@ -51,7 +73,11 @@ class MQTTService:
                 logger.error(f"Connection error: {connection_codes[rc]}")
 
     def on_disconnect(self, client, userdata, rc):
-        self.connected = False
+        # Only reset the backoff once a connection has proven stable, so clients
+        # that keep getting dropped right after connecting still back off
+        if self.connected_at is not None and time.monotonic() - self.connected_at >= settings.MQTT_KEEPALIVE:
+            self.reconnect_attempt = 0
+        self.connected_at = None
         if rc != 0:
             logger.warning(f"Unexpected disconnection from MQTT broker. Code: {rc}")
         else:
@@ -61,89 +87,173 @@ class MQTTService:
         logger.debug(f"MQTT Log: {buf}")
 
     def on_message(self, client, userdata, msg):
+        # Reject malformed messages up front: they are acknowledged and dropped,
+        # since redelivering them can never succeed
+        # Topic format: device/<device_id>/data
+        topic_parts = msg.topic.split('/')
+        try:
+            if len(topic_parts) != 3:
+                raise ValueError("expected device/<device_id>/data")
+            device_uuid = uuid.UUID(topic_parts[1])
+        except ValueError as e:
+            logger.error(f"Ignoring message on topic {msg.topic}: {e}")
+            return
+
         try:
-            # Parse the device ID from the topic
-            # Topic format: device/<device_id>/data
-            device_id = msg.topic.split('/')[1]
-            
-            logger.debug(f"Received message on topic {msg.topic}")
-            
-            # Parse message payload
             payload = json.loads(msg.payload.decode())
-            logger.info(f"Received data for device {device_id}: {payload}")
-            
-            # Create database session
-            db = SessionLocal()
-            try:
-                # Convert string device_id to UUID
-                device_uuid = uuid.UUID(device_id)
-                
-                # Check if device exists
-                device = db.query(Device).filter(Device.deviceid == device_uuid).first()
-                if not device:
-                    logger.error(f"Device {device_id} not found in database")
-                    return
-                
-                # Create new device log entry
-                device_log = DeviceLog(
-                    deviceid=device_uuid,
-                    data=payload
-                )
-                db.add(device_log)
-                db.commit()
-                logger.info(f"Successfully logged data for device {device_id}")
-            except Exception as db_error:
-                db.rollback()
-                logger.error(f"Database error: {db_error}")
-            finally:
-                db.close()
-                
-        except json.JSONDecodeError as e:
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
             logger.error(f"Invalid JSON payload: {e}")
+            return
+        if not isinstance(payload, dict):
+            logger.error(f"Ignoring non-object payload on topic {msg.topic}")
+            return
+
+        device_id = str(device_uuid)
+        logger.info(f"Received data for device {device_id}: {payload}")
+
+        # Create database session
+        db = SessionLocal()
+        try:
+            # Check if device exists
+            device = db.query(Device).filter(Device.deviceid == device_uuid).first()
+            if not device:
+                logger.error(f"Device {device_id} not found in database")
+                return
+
+            # Create new device log entry
+            device_log = DeviceLog(
+                deviceid=device_uuid,
+                data=payload
+            )
+            db.add(device_log)
+            db.commit()
+            logger.info(f"Successfully logged data for device {device_id}")
+            if self.failed_deliveries:
+                self.failed_deliveries.pop(self.delivery_key(msg), None)
+        except (OperationalError, InterfaceError) as db_error:
+            # Connection-level failures are transient; ask for redelivery
+            db.rollback()
+            logger.error(f"Database unavailable: {db_error}")
+            self.withhold_ack(client, msg)
         except Exception as e:
-            logger.error(f"Error processing message: {e}", exc_info=True)
+            # Integrity and data errors would fail again on redelivery
+            db.rollback()
+            logger.error(f"Discarding message for device {device_id}: {e}", exc_info=True)
+        finally:
+            db.close()
+
+    @staticmethod
+    def delivery_key(msg):
+        return hashlib.sha256(msg.topic.encode() + b"\0" + msg.payload).hexdigest()
+
+    def withhold_ack(self, client, msg):
+        """Disconnect before paho sends the PUBACK so the broker redelivers the message.
+
+        paho 1.6.1 acknowledges a QoS 1 message as soon as on_message returns and
+        has no manual ack. A DISCONNECT queued from the callback goes out ahead of
+        the PUBACK and closes the socket, so the PUBACK is never sent. Each message
+        is retried at most MQTT_MAX_REDELIVERIES times so one message can't stall
+        ingestion indefinitely.
+        """
+        if msg.qos == 0 or settings.MQTT_CLEAN_SESSION:
+            logger.error("Message dropped: no persistent session to redeliver it")
+            return
+
+        key = self.delivery_key(msg)
+        attempts = self.failed_deliveries.pop(key, 0) + 1
+        if attempts > settings.MQTT_MAX_REDELIVERIES:
+            logger.error(f"Message on {msg.topic} dropped after {attempts} failed attempts")
+            return
+
+        # Bound the bookkeeping; the oldest entries are the least likely to return
+        while len(self.failed_deliveries) >= 1000:
+            self.failed_deliveries.pop(next(iter(self.failed_deliveries)))
+        self.failed_deliveries[key] = attempts
+
+        logger.warning(f"Disconnecting so the broker redelivers the message (attempt {attempts})")
+        client.disconnect()
 
-    def maintain_connection(self):
-        """Thread to maintain MQTT connection"""
-        while self.running:
-            if not self.connected:
+    def reconnect_delay(self):
+        """Exponential backoff with full jitter so instances don't reconnect in lockstep"""
+        ceiling = min(
+            settings.MQTT_RECONNECT_MAX_DELAY,
+            settings.MQTT_RECONNECT_MIN_DELAY * (2 ** min(self.reconnect_attempt, 16))
+        )
+        self.reconnect_attempt += 1
+        return random.uniform(0, ceiling)
+
+    def run_network_loop(self):
+        """Thread driving the MQTT network loop and reconnecting on failure"""
+        while not self._stop_event.is_set():
+            if self.client.socket() is None:
                 try:
                     logger.info(f"Attempting to connect to {settings.MQTT_BROKER}:{settings.MQTT_PORT}...")
-                    self.client.connect(settings.MQTT_BROKER, settings.MQTT_PORT, 60)
+                    self.client.reconnect()
                 except Exception as e:
-                    logger.error(f"Connection failed: {e}")
-            time.sleep(self.reconnect_interval)
+                    delay = self.reconnect_delay()
+                    logger.error(f"Connection failed: {e}. Retrying in {delay:.1f}s")
+                    self._stop_event.wait(delay)
+                    continue
+
+            # on_message runs inside loop(), and paho acknowledges a QoS 1 message
+            # once the callback returns. A transient database failure disconnects
+            # instead, leaving the message unacknowledged for redelivery.
+            rc = self.client.loop(timeout=1.0)
+            lost = rc != mqtt.MQTT_ERR_SUCCESS or self.client.socket() is None
+            if lost and not self._stop_event.is_set():
+                delay = self.reconnect_delay()
+                logger.warning(f"Connection lost: {mqtt.error_string(rc)}. Reconnecting in {delay:.1f}s")
+                self._stop_event.wait(delay)
+
+        self.drain()
+
+    def drain(self):
+        """Finish pending acknowledgements and disconnect cleanly"""
+        if self.client.socket() is None:
+            return
+        logger.info("Draining MQTT connection...")
+        self.client.disconnect()
+        deadline = time.monotonic() + settings.MQTT_DRAIN_TIMEOUT
+        while self.client.socket() is not None and time.monotonic() < deadline:
+            if self.client.loop(timeout=0.1) != mqtt.MQTT_ERR_SUCCESS:
+                break
+
+    def handle_signal(self, signum, frame):
+        logger.info(f"Received signal {signum}")
+        self._stop_event.set()
 
     def start(self):
         try:
             # Configure client
             self.client.enable_logger(logger)
+            self.client.connect_async(settings.MQTT_BROKER, settings.MQTT_PORT, settings.MQTT_KEEPALIVE)
             
             # Start the network loop in a background thread
-            self.client.loop_start()
+            self._stop_event.clear()
+            self._network_thread = threading.Thread(target=self.run_network_loop, name="mqtt-network")
+            self._network_thread.daemon = True
+            self._network_thread.start()
             
-            # Start connection maintenance thread
-            self.running = True
-            connection_thread = threading.Thread(target=self.maintain_connection)
-            connection_thread.daemon = True
-            connection_thread.start()
+            # Containers are stopped with SIGTERM; treat it like Ctrl+C
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGTERM, self.handle_signal)
             
-            # Keep the main thread alive
+            # Block the main thread until a shutdown is requested
             logger.info("MQTT service started. Press Ctrl+C to stop.")
-            while self.running:
-                time.sleep(1)
+            self._stop_event.wait()
                 
         except KeyboardInterrupt:
             logger.info("Received shutdown signal")
-            self.stop()
         except Exception as e:
             logger.error(f"MQTT Service Error: {e}", exc_info=True)
+        finally:
             self.stop()
 
     def stop(self):
+        if self._network_thread is None:
+            return
         logger.info("Stopping MQTT service...")
-        self.running = False
-        self.client.loop_stop()
-        if self.connected:
-            self.client.disconnect()
+        self._stop_event.set()
+        self._network_thread.join(timeout=settings.MQTT_DRAIN_TIMEOUT + 2)
+        self._network_thread = None
         logger.info("MQTT service stopped")
@@ -0,0 +1,190 @@
+import numpy as np
+import pytest
+
+from app.services import analytics
+
+
+def test_geohash_encode_matches_reference():
+    ix, iy, counts = analytics.grid_density(np.array([57.64911]), np.array([10.40744]), 11)
+    assert analytics.geohash_encode(int(ix[0]), int(iy[0]), 11) == "u4pruydqqvj"
+
+
+def test_grid_density_counts_points_per_cell():
+    lat = np.array([10.0, 10.00001, -33.9])
+    lon = np.array([20.0, 20.00001, 151.2])
+    ix, iy, counts = analytics.grid_density(lat, lon, 6)
+
+    assert sorted(counts.tolist()) == [1, 2]
+    hashes = {analytics.geohash_encode(x, y, 6) for x, y in zip(ix.tolist(), iy.tolist())}
+    assert len(hashes) == 2
+    assert all(len(h) == 6 for h in hashes)
+
+
+def test_grid_density_empty():
+    ix, iy, counts = analytics.grid_density(np.empty(0), np.empty(0), 5)
+    assert ix.size == iy.size == counts.size == 0
+
+
+def _nan(n):
+    return np.full(n, np.nan)
+
+
+def test_detect_stops_splits_runs_at_device_boundary():
+    # Two devices parked at the same spot back to back must yield two stops
+    device_codes = np.array([0] * 6 + [1] * 6)
+    timestamps = np.tile(np.arange(6) * 60.0, 2)
+    lat = np.full(12, 10.0)
+    lon = np.full(12, 20.0)
+
+    devices, _, _, start, end = analytics.detect_stops(
+        device_codes, timestamps, lat, lon, np.zeros(12), 30, 300, 5
+    )
+
+    assert devices.tolist() == [0, 1]
+    assert start.tolist() == [0.0, 0.0]
+    assert end.tolist() == [300.0, 300.0]
+
+
+def test_detect_stops_drops_runs_shorter_than_min_dwell():
+    # Parked 10 minutes, drives, then parked 4 minutes
+    timestamps = np.arange(20) * 60.0
+    lat = np.r_[np.full(10, 10.0), np.linspace(10.01, 10.05, 5), np.full(5, 10.1)]
+    lon = np.full(20, 20.0)
+    device_codes = np.zeros(20, dtype=np.int64)
+
+    devices, stop_lat, stop_lon, start, end = analytics.detect_stops(
+        device_codes, timestamps, lat, lon, _nan(20), 30, 300, 5
+    )
+
+    assert devices.tolist() == [0]
+    assert stop_lat.tolist() == [10.0]
+    # At 60 s sampling the last parked sample's speed window spans the departure
+    assert (start[0], end[0]) == (0.0, 480.0)
+
+
+def _drive(speed_kmh, seconds, interval=2.0):
+    """Samples every interval seconds of a vehicle heading north at speed_kmh"""
+    timestamps = np.arange(0, seconds, interval)
+    lat = _offset(timestamps * speed_kmh / 3.6)
+    return timestamps, lat, np.full(len(timestamps), 20.0)
+
+
+@pytest.mark.parametrize("reported", [True, False])
+def test_detect_stops_ignores_slow_urban_driving(reported):
+    # 40 km/h moves about 22 m per 2 s sample, under stop_radius per step
+    timestamps, lat, lon = _drive(40, 600)
+    speed = np.full(len(timestamps), 40.0) if reported else _nan(len(timestamps))
+
+    devices, *_ = analytics.detect_stops(
+        np.zeros(len(timestamps), dtype=np.int64), timestamps, lat, lon, speed, 30, 300, 5
+    )
+
+    assert devices.size == 0
+
+
+def test_detect_stops_splits_creep_beyond_stop_radius():
+    # Reported speed stays under stop_speed, but the vehicle crawls 250 m
+    timestamps, lat, lon = _drive(1.5, 600)
+
+    devices, *_ = analytics.detect_stops(
+        np.zeros(len(timestamps), dtype=np.int64), timestamps, lat, lon,
+        np.full(len(timestamps), 1.5), 30, 300, 5
+    )
+
+    assert devices.size == 0
+
+
+def test_detect_stops_finds_parked_vehicle_between_drives():
+    rng = np.random.default_rng(0)
+    drive_t, drive_lat, drive_lon = _drive(40, 120)
+    park_t = drive_t[-1] + 2 + np.arange(0, 600, 2.0)
+    park_lat = drive_lat[-1] + rng.normal(0, 2, len(park_t)) / 111195.0  # ~2 m GPS jitter
+    timestamps = np.r_[drive_t, park_t, park_t[-1] + 2 + drive_t]
+    lat = np.r_[drive_lat, park_lat, drive_lat[-1] + drive_lat - drive_lat[0]]
+    lon = np.full(len(timestamps), 20.0)
+
+    devices, stop_lat, _, start, end = analytics.detect_stops(
+        np.zeros(len(timestamps), dtype=np.int64), timestamps, lat, lon, _nan(len(timestamps)), 30, 300, 5
+    )
+
+    assert devices.tolist() == [0]
+    assert abs(stop_lat[0] - drive_lat[-1]) * 111195.0 < 5
+    # The speed window blurs each edge of the stop by up to half its width
+    assert end[0] - start[0] >= 598 - analytics.SPEED_WINDOW_S
+
+
+def test_detect_stops_empty():
+    result = analytics.detect_stops(
+        np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty(0), np.empty(0), 30, 300, 5
+    )
+    assert all(array.size == 0 for array in result)
+
+
+def _offset(meters_north):
+    return 10.0 + meters_north / 111195.0
+
+
+def test_dbscan_labels_noise():
+    lat = np.array([_offset(0), _offset(10), _offset(20), _offset(5000)])
+    lon = np.full(4, 20.0)
+    labels = analytics.dbscan(lat, lon, eps=15, min_samples=2)
+    assert labels.tolist() == [0, 0, 0, -1]
+
+
+def test_dbscan_assigns_border_points():
+    # Points at 0, 10 and 20 m: only the middle one has 3 neighbours (itself
+    # included), so the ends are border points reached from the core point
+    lat = np.array([_offset(0), _offset(10), _offset(20)])
+    lon = np.full(3, 20.0)
+    labels = analytics.dbscan(lat, lon, eps=12, min_samples=3)
+    assert labels.tolist() == [0, 0, 0]
+
+    labels = analytics.dbscan(lat, lon, eps=12, min_samples=4)
+    assert labels.tolist() == [-1, -1, -1]
+
+
+def test_dbscan_separates_clusters():
+    lat = np.array([_offset(0), _offset(5), _offset(1000), _offset(1005)])
+    lon = np.full(4, 20.0)
+    labels = analytics.dbscan(lat, lon, eps=10, min_samples=2)
+    assert labels.tolist() == [0, 0, 1, 1]
+
+
+def test_dbscan_enforces_point_limit(monkeypatch):
+    monkeypatch.setattr(analytics.settings, "ANALYTICS_MAX_CLUSTER_POINTS", 2)
+    with pytest.raises(ValueError):
+        analytics.dbscan(np.zeros(3), np.zeros(3), eps=10, min_samples=2)
+
+
+def test_dbscan_empty():
+    assert analytics.dbscan(np.empty(0), np.empty(0), eps=10, min_samples=2).size == 0
+
+
+def _collection(features):
+    return {"type": "FeatureCollection", "features": [{}] * features}
+
+
+def test_query_cache_returns_memoized_value():
+    cache = analytics.QueryCache(max_features=10, ttl=60)
+    calls = []
+    compute = lambda: calls.append(1) or _collection(2)
+
+    assert cache.get_or_compute("a", compute) is cache.get_or_compute("a", compute)
+    assert len(calls) == 1
+
+
+def test_query_cache_evicts_by_feature_count():
+    cache = analytics.QueryCache(max_features=10, ttl=60)
+    cache.get_or_compute("a", lambda: _collection(4))
+    cache.get_or_compute("b", lambda: _collection(4))
+    cache.get_or_compute("a", lambda: _collection(4))  # refresh "a"
+    cache.get_or_compute("c", lambda: _collection(4))
+
+    assert list(cache._entries) == ["a", "c"]
+    assert cache.size == 8
+
+
+def test_query_cache_skips_oversized_values():
+    cache = analytics.QueryCache(max_features=10, ttl=60)
+    cache.get_or_compute("big", lambda: _collection(11))
+    assert cache.size == 0 and not cache._entries
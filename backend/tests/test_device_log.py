@@ -0,0 +1,74 @@
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from app.routes import device_log
+from app.schemas.device_log import BulkTrackRequest, MAX_TRACK_ROWS
+
+
+def _log(log_id, latitude, longitude):
+    return SimpleNamespace(id=log_id, data={"latitude": latitude, "longitude": longitude})
+
+
+def _ids(logs):
+    return [log.id for log in logs]
+
+
+def test_douglas_peucker_keeps_endpoints_and_corners():
+    points = np.array([[0, 0], [1, 0.0001], [2, 0], [2, 1], [2, 2]], dtype=float)
+    keep = device_log._douglas_peucker(points, 0.01)
+    assert keep.tolist() == [True, False, True, False, True]
+
+
+def test_douglas_peucker_keeps_endpoints_of_stationary_track():
+    keep = device_log._douglas_peucker(np.zeros((5, 2)), 0.001)
+    assert keep.tolist() == [True, False, False, False, True]
+
+
+def test_simplify_track_keeps_parked_final_point():
+    # Drives along the equator, then parks: the last log must survive
+    logs = [_log(i, 0, min(i, 3)) for i in range(7)]
+    assert _ids(device_log._simplify_track(logs, 0.001)) == [0, 6]
+
+
+def test_simplify_track_passes_through_logs_without_coordinates():
+    logs = [
+        _log(0, 0, 0),
+        _log(1, None, None),
+        _log(2, 0, 1),
+        _log(3, "N/A", 2),
+        _log(4, 0, 3),
+        SimpleNamespace(id=5, data={}),
+        _log(6, 0, 4),
+    ]
+    assert _ids(device_log._simplify_track(logs, 0.001)) == [0, 1, 3, 5, 6]
+
+
+def test_simplify_track_short_tracks_are_unchanged():
+    logs = [_log(0, 0, 0), _log(1, "x", 1), _log(2, 0, 2)]
+    assert device_log._simplify_track(logs, 0.001) == logs
+
+
+def test_bulk_track_request_requires_devices():
+    with pytest.raises(ValidationError):
+        BulkTrackRequest(device_ids=[])
+
+
+def test_bulk_track_request_limits_device_count():
+    with pytest.raises(ValidationError):
+        BulkTrackRequest(device_ids=[uuid.uuid4() for _ in range(501)], limit_per_device=1)
+
+
+def test_bulk_track_request_limits_total_rows():
+    devices = [uuid.uuid4() for _ in range(20)]
+    BulkTrackRequest(device_ids=devices, limit_per_device=MAX_TRACK_ROWS // 20)
+    with pytest.raises(ValidationError):
+        BulkTrackRequest(device_ids=devices, limit_per_device=MAX_TRACK_ROWS // 20 + 1)
+
+
+def test_bulk_track_request_deduplicates_devices():
+    device = uuid.uuid4()
+    assert BulkTrackRequest(device_ids=[device, device]).device_ids == [device]
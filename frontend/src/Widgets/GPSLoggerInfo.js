@@ -563,16 +563,20 @@ const GPSLoggerInfo = ({ map }) => {
 
       console.log('Fetching logs with date range:', { start, end }); // Debug log
       
-      const response = await axios.get(`https://api.gnapitech.org/device/${device}/logs/`, {
-        params: {
-          start_date: start,
-          end_date: end,
-          limit: 1000
-        }
+      const response = await axios.post('https://api.gnapitech.org/device-log/tracks', {
+        device_ids: [device],
+        start_date: start,
+        end_date: end,
+        limit_per_device: 1000
       });
 
-      const logs = response.data;
+      const [track] = response.data;
+      const logs = track ? track.logs : [];
       hide(); // Hide loading message
+
+      if (track && track.truncated) {
+        message.info('Showing the first 1000 GPS logs; narrow the time range to see the rest');
+      }
       
       if (!logs.length) {
         message.warning(`No logs found between ${moment(start).format('YYYY-MM-DD HH:mm:ss')} and ${moment(end).format('YYYY-MM-DD HH:mm:ss')} UTC`);